@@ -7,6 +7,7 @@ import numpy as np
 # _____CONSTANTS_____
 
 MICROSECOND_TO_SECOND_FACTOR = 1e+6
+SAMPLES_PER_RECORD = 512  # the number of samples per record of the .ncs file
 
 
 class Channel:
@@ -38,12 +39,38 @@ class Channel:
         self.channel_number = int(channel_number)
         self.channel_name = self._header['AcqEntName']
 
-        # properties that must be computed from source
+        # properties that must be computed from source -- scaling is deferred until the whole recording is needed,
+        # so that streaming only ever scales one chunk at a time
         self._raw_readings = raw_readings.ravel()
-        self.readings = self._raw_readings * float(self._header['ADBitVolts']) * self.scaling_factor[0]
+        self._readings = None
 
     # _____PROPERTIES_____
 
+    @property
+    def readings(self):
+        """
+
+        Returns:
+            readings for the whole recording in the channel's scaling
+
+        """
+
+        if self._readings is None:
+            self._readings = self.read_chunk(None, None)
+
+        return self._readings
+
+    @property
+    def number_of_readings(self):
+        """
+
+        Returns:
+            the number of readings in the recording, without scaling them
+
+        """
+
+        return self._raw_readings.shape[0]
+
     @property
     def duration(self):
         """
@@ -53,7 +80,7 @@ class Channel:
 
         """
 
-        return len(self.readings) / self.sampling_frequency
+        return self.number_of_readings / self.sampling_frequency
 
     @property
     def date_and_time(self):
@@ -80,9 +107,49 @@ class Channel:
 
         """
 
-        return np.interp(np.arange(len(self.readings)), np.arange(0, len(self.readings), 512),
+        return np.interp(np.arange(self.number_of_readings), np.arange(0, self.number_of_readings, SAMPLES_PER_RECORD),
                          self._time_stamps).astype(np.uint64)
 
+    # _____PUBLIC METHODS_____
+
+    def read_chunk(self, start, stop):
+        """
+
+        Scale a slice of the raw readings without touching the rest of the recording
+
+        Args:
+            start: int
+                index of the first reading in the chunk
+            stop: int
+                index one past the last reading in the chunk
+
+        Returns:
+            readings between start and stop in the channel's scaling
+
+        """
+
+        return self._raw_readings[start:stop] * float(self._header['ADBitVolts']) * self.scaling_factor[0]
+
+    def get_time_stamps(self, indices):
+        """
+
+        Map reading indices onto timestamps using the TimeStamp of the record each reading belongs to
+
+        Args:
+            indices: [int]
+                indices into the readings
+
+        Returns:
+            Timestamp (in microseconds) corresponding to each index
+
+        """
+
+        indices = np.asarray(indices, dtype=np.int64)
+        records, offsets = np.divmod(indices, SAMPLES_PER_RECORD)
+
+        return (self._time_stamps[records] + offsets * MICROSECOND_TO_SECOND_FACTOR / self.sampling_frequency).astype(
+            np.uint64)
+
     # _____CLASS METHODS_____
 
     @staticmethod
@@ -0,0 +1,185 @@
+# imports
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from scripts.processing import SAMPLES_PER_CHUNK, iterate_chunks, filter_chunks
+
+# _____CONSTANTS_____
+
+MAD_TO_STD_FACTOR = 0.6745  # median absolute deviation of a standard normal distribution
+INITIAL_WAVEFORM_CAPACITY = 1024  # number of waveform snippets preallocated before the first detection
+
+
+# _____PUBLIC FUNCTIONS____
+
+def estimate_noise(chunk, baseline=None):
+    """
+
+    Robust estimate of the noise standard deviation from the median absolute deviation, as per Quiroga et al. (2004)
+
+    Args:
+        chunk: [float]
+            MxN matrix of (filtered) channel readings
+        baseline: [float]
+            if applicable, baseline of each of the M channels -- otherwise, the median of each channel
+
+    Returns:
+        noise: [float]
+            noise standard deviation of each of the M channels
+
+    """
+
+    if baseline is None:
+        baseline = np.median(chunk, axis=-1, keepdims=True)
+
+    return np.median(np.abs(chunk - baseline), axis=-1) / MAD_TO_STD_FACTOR
+
+
+def detect_spikes(channel, sos=None, threshold=5.0, polarity='negative', refractory_period=1e-3,
+                  pre_crossing=0.5e-3, post_crossing=1e-3, chunk_size=SAMPLES_PER_CHUNK):
+    """
+
+    Detect threshold crossings in a channel and extract the surrounding waveform snippets, one chunk at a time
+
+    Args:
+        channel: Channel
+            the channel to look through
+        sos: [float]
+            if applicable, second-order sections to filter with before detection, as returned by design_filter
+        threshold: float
+            detection threshold as a multiple of the noise standard deviation, estimated on each chunk around its median
+        polarity: 'negative', 'positive', or 'both'
+            direction in which the readings must cross the threshold
+        refractory_period: float
+            minimum time (in seconds) between two detections
+        pre_crossing: float
+            length (in seconds) of each snippet before the crossing
+        post_crossing: float
+            length (in seconds) of each snippet from the crossing onwards
+        chunk_size: int
+            number of readings held in memory at any one time
+
+    Returns:
+        indices: [int]
+            index into the readings of each crossing
+        time_stamps: [int]
+            timestamp (in microseconds) of each crossing
+        waveforms: [float]
+            KxL matrix of snippets where K is a crossing and L is a reading around it -- readings are centred on the
+            median of the chunk they came from
+
+    """
+
+    if polarity not in ('negative', 'positive', 'both'):
+        raise ValueError('Unknown polarity: {}'.format(polarity))
+
+    # convert durations to numbers of readings
+    pre = int(round(pre_crossing * channel.sampling_frequency))
+    post = int(round(post_crossing * channel.sampling_frequency))
+    refractory = int(round(refractory_period * channel.sampling_frequency))
+    offsets = np.arange(-pre, post)
+
+    # preallocate snippets -- grown geometrically should the recording be busier than expected
+    waveforms = np.empty((INITIAL_WAVEFORM_CAPACITY, pre + post))
+    indices = []
+    number_of_spikes = 0
+    last_spike = -refractory
+
+    # centred readings carried over from the previous chunk so that crossings and snippets can span chunk boundaries,
+    # alongside the (first reading, threshold) of each chunk still in the buffer
+    buffer = np.empty(0)
+    segments = []
+    buffer_start = 0
+    searched = 0
+
+    chunks = iterate_chunks([channel], chunk_size)
+    if sos is not None:
+        chunks = filter_chunks(chunks, sos)
+
+    for chunk in chunks:
+        # centre on the chunk's median so that a DC offset does not shift the readings away from the threshold
+        readings = chunk[0] - np.median(chunk[0])
+        segments.append((buffer_start + len(buffer), threshold * estimate_noise(readings, 0)))
+
+        buffer = np.concatenate((buffer, readings))
+
+        # only look at positions with a full snippet available -- the rest is deferred to the next chunk
+        first = max(searched, pre, 1) - buffer_start
+        last = len(buffer) - post
+        if last > first:
+            if polarity == 'negative':
+                signal = -buffer[first - 1:last]
+            elif polarity == 'positive':
+                signal = buffer[first - 1:last]
+            else:
+                signal = np.abs(buffer[first - 1:last])
+
+            # compare each reading against the threshold of the chunk it came from
+            above = np.empty(len(signal), dtype=bool)
+            for i, (segment_start, segment_threshold) in enumerate(segments):
+                segment_stop = segments[i + 1][0] if i + 1 < len(segments) else buffer_start + len(buffer)
+                start = max(segment_start - buffer_start, first - 1) - (first - 1)
+                stop = min(segment_stop - buffer_start, last) - (first - 1)
+                if stop > start:
+                    above[start:stop] = signal[start:stop] > segment_threshold
+            crossings = np.flatnonzero(above[1:] & ~above[:-1]) + first
+
+            # enforce the refractory period, keeping the earliest of any two crossings that are too close
+            kept = []
+            for crossing in crossings + buffer_start:
+                if crossing - last_spike >= refractory:
+                    kept.append(crossing)
+                    last_spike = crossing
+
+            if kept:
+                kept = np.asarray(kept)
+
+                # grow the preallocated snippets if needed
+                if number_of_spikes + len(kept) > waveforms.shape[0]:
+                    grown = np.empty((max(2 * waveforms.shape[0], number_of_spikes + len(kept)), pre + post))
+                    grown[:number_of_spikes] = waveforms[:number_of_spikes]
+                    waveforms = grown
+
+                waveforms[number_of_spikes:number_of_spikes + len(kept)] = buffer[
+                    kept[:, np.newaxis] - buffer_start + offsets]
+                number_of_spikes += len(kept)
+                indices.append(kept)
+
+            searched = last + buffer_start
+
+        # keep what is needed for the deferred positions -- their snippets and the reading preceding them
+        keep_from = max(searched - pre - 1, buffer_start)
+        buffer = buffer[keep_from - buffer_start:]
+        buffer_start = keep_from
+        segments = [segment for i, segment in enumerate(segments)
+                    if i + 1 == len(segments) or segments[i + 1][0] > keep_from]
+
+    indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+
+    return indices, channel.get_time_stamps(indices), waveforms[:number_of_spikes]
+
+
+def detect_spikes_in_channels(channels, max_workers=None, **kwargs):
+    """
+
+    Runs the function above across an array of channels in parallel
+
+    Args:
+        channels: [Channels]
+            array of channels to look through
+        max_workers: int
+            if applicable, the maximum number of channels processed at once
+        **kwargs:
+            passed on to detect_spikes
+
+    Returns:
+        detections: [(indices, time_stamps, waveforms)]
+            detections for each channel, in the same order as channels
+
+    """
+
+    # numpy and scipy release the GIL for the heavy lifting, so threads suffice and avoid copying the readings
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda channel: detect_spikes(channel, **kwargs), channels))
@@ -1,23 +1,34 @@
 # imports
 
+import hashlib
+import json
+import os
+import tempfile
 import warnings
+import zipfile
 
 import numpy as np
 import pandas as pd
 
-from external.neuralynxio.scripts.channel import Channel
+from external.neuralynxio.scripts.channel import Channel, SAMPLES_PER_RECORD
 
 # note, detailed explanation on the file structures may be found at https://neuralynx.com/_software/NeuralynxDataFileFormats.pdf
 
 # _____CONSTANTS_____
 
 HEADER_SIZE = 16 * 1024  # header has 16 kilobytes length (note that this seems to be variable - if issues arise, double-check the header length)
-SAMPLES_PER_RECORD = 512  # the number of samples per record of the .ncs file
+NCS_RECORD_FORMAT = np.dtype([('TimeStamp', np.uint64),  # timestamp in microseconds for this record -- sample time for the first data point in the samples array
+                              ('ChannelNumber', np.uint32),  # channel number for this record
+                              ('SampleFreq', np.uint32),  # sampling frequency
+                              ('NumValidSamples', np.uint32),  # number of values in Samples containing valid data
+                              ('Samples', np.int16, SAMPLES_PER_RECORD)])  # data points for a record -- currently, the samples array is a [512] array
+CACHE_SAMPLES_EXTENSION = '.samples.int16'  # sidecar holding the samples of all records back to back
+CACHE_RECORDS_EXTENSION = '.records.npz'  # sidecar holding the per-record metadata, header and source file signature
 
 
 # _____PUBLIC FUNCTIONS_____
 
-def read_neuralynx_continuous_file(file_path, scaling='micro'):
+def read_neuralynx_continuous_file(file_path, scaling='micro', cache=False, cache_directory=None):
     """
 
     Function for taking a neuralynx .ncs file and reading it in a  python compatible way
@@ -27,12 +38,35 @@ def read_neuralynx_continuous_file(file_path, scaling='micro'):
             .ncs file containing the recordings.
         scaling: None, 'micro', or 'milli'
             if None, scales the data in Volts -- otherwise, scales according to prefix
+        cache: bool
+            if True, write a sidecar cache on first read and memory-map its samples on later reads
+        cache_directory: str
+            if applicable, where to keep the sidecar cache -- otherwise, it is kept next to the .ncs file
 
     Returns:
         A NeuralynxNCS object for the given data file
 
     """
 
+    # use the sidecar cache if it is still valid
+    if cache:
+        samples_path, records_path = _get_cache_paths(file_path, cache_directory)
+        cached = _read_ncs_cache(file_path, samples_path, records_path)
+        if cached is not None:
+            hdr_dict, records, samples = cached
+
+            # the per-record metadata is all the checks need, so they are cheap to repeat on every read
+            _check_ncs_records(records)
+
+            return Channel(channel_number=records['ChannelNumber'][0],
+                           time_stamps=records['TimeStamp'],
+                           raw_readings=samples,
+                           header=hdr_dict,
+                           scaling=scaling)
+
+        # taken before reading so that a file still being written is never cached as newer than what was read
+        signature = _get_source_signature(file_path)
+
     # open file
     fid = open(file_path, 'rb')
 
@@ -43,12 +77,7 @@ def read_neuralynx_continuous_file(file_path, scaling='micro'):
     fid.seek(HEADER_SIZE)
 
     # Read data according to Neuralynx information
-    data_format = np.dtype([('TimeStamp', np.uint64),  # timestamp in microseconds for this record -- sample time for the first data point in the samples array
-                            ('ChannelNumber', np.uint32),  # channel number for this record
-                            ('SampleFreq', np.uint32),  # sampling frequency
-                            ('NumValidSamples', np.uint32),  # number of values in Samples containing valid data
-                            ('Samples', np.int16, SAMPLES_PER_RECORD)])  # data points for a record -- currently, the samples array is a [512] array
-    raw = np.fromfile(fid, dtype=data_format)
+    raw = np.fromfile(fid, dtype=NCS_RECORD_FORMAT)
 
     # close file
     fid.close()
@@ -56,6 +85,10 @@ def read_neuralynx_continuous_file(file_path, scaling='micro'):
     # check that the integrity of the data -- might seem silly, but Neuralynx be wack
     _check_ncs_records(raw)
 
+    # write the sidecar cache so that later reads can skip parsing and checking the records
+    if cache:
+        _write_ncs_cache(file_path, signature, samples_path, records_path, hdr_dict, raw)
+
     # return a variable mapping the read file onto the relevant data structure
     return Channel(channel_number=raw['ChannelNumber'][0],
                    time_stamps=raw['TimeStamp'],
@@ -64,7 +97,7 @@ def read_neuralynx_continuous_file(file_path, scaling='micro'):
                    scaling=scaling)
 
 
-def read_neuralynx_continuous_files(file_paths):
+def read_neuralynx_continuous_files(file_paths, cache=False, cache_directory=None):
     """
 
     Runs the function above but for an array of files
@@ -72,6 +105,10 @@ def read_neuralynx_continuous_files(file_paths):
     Args:
         file_paths: [str]
             File paths of .ncs recordings.
+        cache: bool
+            if True, write a sidecar cache on first read and memory-map its samples on later reads
+        cache_directory: str
+            if applicable, where to keep the sidecar caches -- otherwise, they are kept next to the .ncs files
 
     Returns:
         ncs_files: [Channel]
@@ -83,13 +120,31 @@ def read_neuralynx_continuous_files(file_paths):
 
     for file in file_paths:
         try:
-            channels.append(read_neuralynx_continuous_file(file))
+            channels.append(read_neuralynx_continuous_file(file, cache=cache, cache_directory=cache_directory))
         except:
             print('Could not open file {}'.format(file))
 
     return channels
 
 
+def read_neuralynx_header(file_path):
+    """
+
+    Read only the header of a neuralynx file, without touching any of its records
+
+    Args:
+        file_path: str
+            neuralynx file to peek into
+
+    Returns:
+        hdr_dict: dict of header
+
+    """
+
+    with open(file_path, 'rb') as fid:
+        return _parse_header(_read_header(fid))
+
+
 def read_neuralynx_events_file(file_path):
     """
 
@@ -206,7 +261,7 @@ def _check_ncs_records(raw):
 
     Args:
 
-        raw: the raw extracted data
+        raw: the raw extracted data, or a mapping of its per-record metadata fields
 
     """
 
@@ -215,17 +270,140 @@ def _check_ncs_records(raw):
     dt = np.abs(dt - dt[0])
 
     # check that channel number remains the same
-    if not np.all(raw['ChannelNumber'] == raw[0]['ChannelNumber']):
+    if not np.all(raw['ChannelNumber'] == raw['ChannelNumber'][0]):
         warnings.warn('Channel number changed during record sequence')
 
     # check that the sampling frequency remains the same
-    if not np.all(raw['SampleFreq'] == raw[0]['SampleFreq']):
+    if not np.all(raw['SampleFreq'] == raw['SampleFreq'][0]):
         warnings.warn('Sampling frequency changed during record sequence')
 
     # check that there are the correct number of samples per time point
-    if not np.all(raw['NumValidSamples'] == 512):
+    if not np.all(raw['NumValidSamples'] == SAMPLES_PER_RECORD):
         warnings.warn('Invalid samples in one or more records')
 
     # check that the time difference is always less than 1
     if not np.all(dt <= 1):
         warnings.warn('Time stamp difference tolerance exceeded')
+
+
+def _get_cache_paths(file_path, cache_directory=None):
+    # get the paths of the sidecar samples and records files of an .ncs file
+
+    directory, file_name = os.path.split(file_path)
+
+    # a shared cache directory holds files of the same name from many sessions, so key them by their whole path
+    if cache_directory is not None:
+        directory = cache_directory
+        file_name = '{}.{}'.format(file_name, hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16])
+
+    return (os.path.join(directory, file_name + CACHE_SAMPLES_EXTENSION),
+            os.path.join(directory, file_name + CACHE_RECORDS_EXTENSION))
+
+
+def _get_source_signature(file_path):
+    # the size and modification time of a file -- a cache is invalidated as soon as either changes
+
+    stat = os.stat(file_path)
+
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _write_ncs_cache(file_path, signature, samples_path, records_path, hdr_dict, raw):
+    """
+    Write the samples of all records contiguously alongside a small file of per-record metadata
+
+    Args:
+
+        file_path: the .ncs file the cache is for
+        signature: the size and modification time of the .ncs file before it was read
+        samples_path: path of the sidecar samples file
+        records_path: path of the sidecar records file
+        hdr_dict: the parsed header
+        raw: the raw extracted data
+
+    """
+
+    # write to uniquely named temporary files first so that an interrupted write never leaves a cache that looks valid,
+    # and concurrent readers caching the same file never write into each other's files
+    temporary_paths = []
+
+    try:
+        samples_fid, samples_temporary_path = _make_temporary_file(samples_path, temporary_paths)
+        with samples_fid:
+            raw['Samples'].tofile(samples_fid)
+
+        records_fid, records_temporary_path = _make_temporary_file(records_path, temporary_paths)
+        with records_fid as fid:
+            np.savez(fid,
+                     source=os.path.abspath(file_path),
+                     signature=signature,
+                     header=json.dumps(hdr_dict),
+                     TimeStamp=raw['TimeStamp'],
+                     ChannelNumber=raw['ChannelNumber'],
+                     SampleFreq=raw['SampleFreq'],
+                     NumValidSamples=raw['NumValidSamples'])
+
+        # the records file goes last as it is the one that marks the cache as valid
+        os.replace(samples_temporary_path, samples_path)
+        os.replace(records_temporary_path, records_path)
+    except OSError as e:
+        warnings.warn('Could not write cache for {}: {}'.format(file_path, e))
+
+        # do not leave partial files behind
+        for temporary_path in temporary_paths:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+
+
+def _make_temporary_file(path, temporary_paths):
+    # open a uniquely named temporary file next to path, registering it so that it can be cleaned up on failure
+
+    directory, file_name = os.path.split(path)
+    fd, temporary_path = tempfile.mkstemp(suffix='.tmp', prefix=file_name + '.', dir=directory or None)
+    temporary_paths.append(temporary_path)
+
+    return os.fdopen(fd, 'wb'), temporary_path
+
+
+def _read_ncs_cache(file_path, samples_path, records_path):
+    """
+    Read the sidecar cache of an .ncs file, if it is still valid
+
+    Args:
+
+        file_path: the .ncs file the cache is for
+        samples_path: path of the sidecar samples file
+        records_path: path of the sidecar records file
+
+    Returns:
+        None if there is no valid cache -- otherwise, the header, per-record metadata and memory-mapped samples
+
+    """
+
+    if not (os.path.isfile(samples_path) and os.path.isfile(records_path)):
+        return None
+
+    # the cache is optional, so a damaged or foreign sidecar only means parsing the .ncs file again
+    try:
+        with np.load(records_path) as cached:
+            # the cache belongs to another file, or the source file changed since the cache was written
+            if str(cached['source']) != os.path.abspath(file_path) or not np.array_equal(
+                    cached['signature'], _get_source_signature(file_path)):
+                return None
+
+            hdr_dict = json.loads(str(cached['header']))
+            records = {name: cached[name] for name in ('TimeStamp', 'ChannelNumber', 'SampleFreq', 'NumValidSamples')}
+
+        # the samples file does not hold all records
+        number_of_records = records['TimeStamp'].shape[0]
+        expected_size = number_of_records * NCS_RECORD_FORMAT['Samples'].itemsize
+        if number_of_records == 0 or os.path.getsize(samples_path) != expected_size:
+            return None
+
+        samples = np.memmap(samples_path, dtype=np.int16, mode='r', shape=(number_of_records, SAMPLES_PER_RECORD))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, zipfile.BadZipFile):
+        return None
+
+    return hdr_dict, records, samples
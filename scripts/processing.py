@@ -1,4 +1,10 @@
 import matplotlib.pyplot as plt
+import numpy as np
+from scipy import signal
+
+# _____CONSTANTS_____
+
+SAMPLES_PER_CHUNK = 512 * 1024  # number of readings per channel held in memory at any one time when streaming
 
 
 # _____PUBLIC FUNCTIONS____
@@ -90,7 +96,7 @@ def check_metadata(channels):
     # for all subsequent channel, make sure there metadata is the same
     for i, channel in enumerate(channels):
         assert date == channel.date_and_time, 'Dates do not match for channel {}'.format(i)
-        assert number_of_readings == channel.readings.shape[0], 'Number of readings do not match for channel {}'.format(
+        assert number_of_readings == channel.number_of_readings, 'Number of readings do not match for channel {}'.format(
             i)
         assert index == channel.index, 'Indices do not match for channel {}'.format(i)
         assert sampling_frequency == channel.sampling_frequency, 'Sampling frequencies do not match for channel {}'.format(
@@ -135,6 +141,193 @@ def extract_records(channels):
     return channel_data, channel_names, channel_types
 
 
+def design_filter(sampling_frequency, low_cutoff=None, high_cutoff=None, notch_frequencies=None, order=4,
+                  quality_factor=30.0):
+    """
+
+    Design a cascade of second-order sections implementing a band-pass and/or notch filter
+
+    Args:
+        sampling_frequency: float
+            sampling frequency of the channels to be filtered
+        low_cutoff: float
+            if applicable, high-pass cutoff frequency (in Hz)
+        high_cutoff: float
+            if applicable, low-pass cutoff frequency (in Hz)
+        notch_frequencies: [float]
+            if applicable, frequencies (in Hz) to be notched out -- e.g. line noise and its harmonics
+        order: int
+            order of the butterworth band-pass filter
+        quality_factor: float
+            quality factor of each notch filter
+
+    Returns:
+        sos: [float]
+            Kx6 array of second-order sections, as expected by scipy.signal.sosfilt
+
+    """
+
+    sections = []
+
+    # band-pass, high-pass or low-pass depending on which cutoffs were given
+    if low_cutoff is not None and high_cutoff is not None:
+        sections.append(signal.butter(order, [low_cutoff, high_cutoff], btype='bandpass', output='sos',
+                                      fs=sampling_frequency))
+    elif low_cutoff is not None:
+        sections.append(signal.butter(order, low_cutoff, btype='highpass', output='sos', fs=sampling_frequency))
+    elif high_cutoff is not None:
+        sections.append(signal.butter(order, high_cutoff, btype='lowpass', output='sos', fs=sampling_frequency))
+
+    # one notch per frequency
+    for notch_frequency in notch_frequencies or []:
+        b, a = signal.iirnotch(notch_frequency, quality_factor, fs=sampling_frequency)
+        sections.append(signal.tf2sos(b, a))
+
+    if not sections:
+        raise ValueError('At least one cutoff or notch frequency must be given to design a filter')
+
+    return np.vstack(sections)
+
+
+def iterate_chunks(channels, chunk_size=SAMPLES_PER_CHUNK):
+    """
+
+    Iterate over the readings of all channels a chunk at a time, rather than building the full matrix in memory
+
+    Args:
+        channels: [Channels]
+            array of Channels -- these should have passed check_metadata
+        chunk_size: int
+            number of readings per channel in each chunk
+
+    Yields:
+        chunk: [float]
+            MxN matrix of channel readings where M is the channel id and N is at most chunk_size readings
+
+    """
+
+    number_of_readings = min(channel.number_of_readings for channel in channels)
+
+    for start in range(0, number_of_readings, chunk_size):
+        stop = min(start + chunk_size, number_of_readings)
+        yield np.vstack([channel.read_chunk(start, stop) for channel in channels])
+
+
+def filter_chunks(chunks, sos):
+    """
+
+    Apply a causal IIR filter to a stream of chunks, carrying the filter state from one chunk to the next so that the
+    output is identical to filtering the whole recording at once with scipy.signal.sosfilt
+
+    Args:
+        chunks: iterable of [float]
+            MxN chunks of channel readings, as yielded by iterate_chunks
+        sos: [float]
+            second-order sections, as returned by design_filter
+
+    Yields:
+        filtered: [float]
+            MxN chunk of filtered readings
+
+    """
+
+    zi = None
+
+    for chunk in chunks:
+        # filters start from rest, as they would for a whole-array run
+        if zi is None:
+            zi = np.zeros((sos.shape[0], chunk.shape[0], 2))
+
+        filtered, zi = signal.sosfilt(sos, chunk, axis=-1, zi=zi)
+        yield filtered
+
+
+def rereference_chunks(chunks, method='average', pairs=None):
+    """
+
+    Re-reference a stream of chunks
+
+    Args:
+        chunks: iterable of [float]
+            MxN chunks of channel readings, as yielded by iterate_chunks
+        method: 'average' or 'bipolar'
+            if 'average', subtract the common average across channels -- otherwise, subtract channel pairs
+        pairs: [(int, int)]
+            if method is 'bipolar', the (anode, cathode) channel indices of each derivation
+
+    Yields:
+        rereferenced: [float]
+            re-referenced chunk -- MxN for 'average' and PxN for 'bipolar', where P is the number of pairs
+
+    """
+
+    if method == 'average':
+        for chunk in chunks:
+            yield chunk - chunk.mean(axis=0)
+    elif method == 'bipolar':
+        if not pairs:
+            raise ValueError('Bipolar re-referencing requires channel pairs')
+        anodes, cathodes = (list(indices) for indices in zip(*pairs))
+        for chunk in chunks:
+            yield chunk[anodes] - chunk[cathodes]
+    else:
+        raise ValueError('Unknown re-referencing method: {}'.format(method))
+
+
+def get_bipolar_names(channel_names, pairs):
+    """
+
+    Name the derivations produced by bipolar re-referencing
+
+    Args:
+        channel_names: [str]
+            the channel names, as returned by extract_records
+        pairs: [(int, int)]
+            the (anode, cathode) channel indices of each derivation
+
+    Returns:
+        names: [str]
+            names of the form 'anode-cathode'
+
+    """
+
+    return ['{}-{}'.format(channel_names[anode], channel_names[cathode]) for anode, cathode in pairs]
+
+
+def preprocess_channels(channels, sos=None, reference=None, pairs=None, chunk_size=SAMPLES_PER_CHUNK):
+    """
+
+    Stream channels through filtering and re-referencing with bounded memory
+
+    Args:
+        channels: [Channels]
+            array of Channels -- these should have passed check_metadata
+        sos: [float]
+            if applicable, second-order sections to filter with, as returned by design_filter
+        reference: None, 'average', or 'bipolar'
+            if applicable, the re-referencing method
+        pairs: [(int, int)]
+            if reference is 'bipolar', the (anode, cathode) channel indices of each derivation
+        chunk_size: int
+            number of readings per channel in each chunk
+
+    Returns:
+        chunks: generator of [float]
+            processed chunks of channel readings, ready to be passed on to an exporter such as utils.io.chunks_to_mda
+
+    """
+
+    chunks = iterate_chunks(channels, chunk_size)
+
+    if sos is not None:
+        chunks = filter_chunks(chunks, sos)
+
+    if reference is not None:
+        chunks = rereference_chunks(chunks, reference, pairs)
+
+    return chunks
+
+
 # _____PRIVATE FUNCTIONS____
 
 # noinspection PyProtectedMember
@@ -142,7 +335,7 @@ def _get_expected_data(channel):
     # get all relevant metadata from a single channel object
 
     date = channel.date_and_time
-    number_of_readings = channel.readings.shape[0]
+    number_of_readings = channel.number_of_readings
     sampling_frequency = channel.sampling_frequency
     index = channel.index
     first_timestamp = channel._time_stamps[0]
@@ -270,6 +270,12 @@ def readmda_header(path):
     return _read_header(path)
 
 
+def writemda_header(path, H):
+    if (file_extension(path) == '.npy'):
+        raise Exception('Cannot write mda header for .npy file.')
+    return _write_header(path, H)
+
+
 def _write_header(path, H, rewrite=False):
     if rewrite:
         f = open(path, "r+b")
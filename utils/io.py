@@ -1,11 +1,20 @@
 import ntpath
 import os
 import gc
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 from utils.external import mdaio
 
+# _____CONSTANTS_____
+
+CONTINUATION_PATTERN = re.compile(r'^(?P<name>.+)_(?P<index>\d{4})$')  # e.g. CSC1_0001 continues CSC1
+
+
+# _____PUBLIC FUNCTIONS____
 
 def get_all_files_with_extension(directory, extension, keyword=None):
     """
@@ -25,23 +34,7 @@ def get_all_files_with_extension(directory, extension, keyword=None):
             array of file paths
     """
 
-    file_paths = []
-
-    # iterate over all files in directory
-    for file in os.listdir(directory):
-
-        # iterate over all files with a given extension
-        if file.endswith(extension):
-
-            # no further sorting is required by keyword
-            if keyword is None:
-                file_paths.append(os.path.join(directory, file))
-
-            # sort further by keyword
-            else:
-                file_paths.append(os.path.join(directory, file)) if keyword in file else None
-
-    return sorted(file_paths)
+    return sorted(entry.path for entry in _scan_directory(directory, extension, keyword))
 
 
 def remove_paths_with_continuation(file_paths):
@@ -58,18 +51,92 @@ def remove_paths_with_continuation(file_paths):
 
     """
 
-    kept_paths = []
+    return [file_path for file_path in file_paths if _parse_file_name(ntpath.basename(file_path))[1] == 0]
 
-    for file_path in file_paths:
-        file_name_without_extension = ntpath.basename(file_path).split('.ncs')[0]
 
-        # if the channel is part of a series, return the index. Otherwise, return 0.
+def build_session_manifest(directory, extension='.ncs', keyword=None):
+    """
+
+    Build a manifest of all recordings in a directory in a single pass, peeking only at the header of each file
+
+    Args:
+        directory: str
+            path to directory to look through
+        extension: str
+            type of files to look through
+        keyword: str
+            if applicable, get only files with this keyword
+
+    Returns:
+        manifest: {float: {str: [dict]}}
+            recordings grouped by sampling frequency, then by channel name -- each channel holds a list of files ordered
+            by continuation index, described by their 'path', 'continuation', 'size', 'number_of_records' and
+            'sampling_frequency'. Files that cannot be read are left out with a warning
+
+    """
+
+    # imported here so that the generic io helpers do not depend on the reader
+    from scripts.neuralynxIO import HEADER_SIZE, NCS_RECORD_FORMAT, read_neuralynx_header
+
+    manifest = {}
+
+    for entry in _scan_directory(directory, extension, keyword):
+        file_channel_name, continuation = _parse_file_name(entry.name)
+
+        # the header is all that is needed for the channel name and sampling frequency -- records are left untouched
         try:
-            _ = file_name_without_extension.split('_')[1]
-        except:
-            kept_paths.append(file_path)
+            header = read_neuralynx_header(entry.path)
+            size = entry.stat().st_size
+            sampling_frequency = float(header['SamplingFrequency']) if 'SamplingFrequency' in header else None
+        except (OSError, ValueError) as e:
+            warnings.warn('Could not read {}: {}'.format(entry.path, e))
+            continue
+
+        channel_name = header.get('AcqEntName', file_channel_name)
+
+        manifest.setdefault(sampling_frequency, {}).setdefault(channel_name, []).append(
+            {'path': entry.path,
+             'continuation': continuation,
+             'size': size,
+             'number_of_records': max(size - HEADER_SIZE, 0) // NCS_RECORD_FORMAT.itemsize,
+             'sampling_frequency': sampling_frequency})
+
+    # order continuations within each channel
+    for channels in manifest.values():
+        for files in channels.values():
+            files.sort(key=lambda file: file['continuation'])
+
+    return manifest
+
+
+def build_session_manifests(directories, extension='.ncs', keyword=None, max_workers=None):
+    """
+
+    Runs the function above but for an array of directories, scanning them concurrently
+
+    Args:
+        directories: [str]
+            paths to directories to look through -- e.g. one per patient
+        extension: str
+            type of files to look through
+        keyword: str
+            if applicable, get only files with this keyword
+        max_workers: int
+            if applicable, the maximum number of directories scanned at once
+
+    Returns:
+        manifests: {str: manifest}
+            manifest of each directory, by directory -- directories that cannot be scanned are left out with a warning
+
+    """
+
+    # scanning is bound by file system latency rather than computation, so threads are enough
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        manifests = executor.map(lambda directory: _try_build_session_manifest(directory, extension, keyword),
+                                 directories)
+
+        return {directory: manifest for directory, manifest in zip(directories, manifests) if manifest is not None}
 
-    return kept_paths
 
 def np_to_mda(path_to_np, output_path, dtype='float64', verbose=True):
     """
@@ -113,3 +180,74 @@ def np_to_mda(path_to_np, output_path, dtype='float64', verbose=True):
     del traces
     gc.collect()
 
+
+def chunks_to_mda(chunks, number_of_channels, number_of_readings, output_path, dtype='float64'):
+    """
+
+    Writes a stream of MxN chunks to a single mda file without holding the whole recording in memory
+
+    Args:
+        chunks: iterable of [float]
+            MxN chunks of channel readings, e.g. from scripts.processing.preprocess_channels
+        number_of_channels: int
+            number of rows (M) in every chunk
+        number_of_readings: int
+            total number of readings (N) across all chunks
+        output_path: str
+            path to save the mda file
+        dtype: str
+            data type by which to save the mda file -- can be 'uint8', 'uint16', 'uint32' 'int16' 'int32' 'float32', 'float64'
+
+    """
+
+    # write the header up front as the final dimensions are already known
+    header = mdaio.MdaHeader(dtype, [number_of_channels, number_of_readings])
+    if not mdaio.writemda_header(output_path, header):
+        raise IOError('Could not write mda header to {}'.format(output_path))
+
+    written = 0
+
+    with open(output_path, 'r+b') as f:
+        f.seek(header.header_size)
+
+        # mda is column-major, so each chunk is laid out reading by reading
+        for chunk in chunks:
+            assert chunk.shape[0] == number_of_channels, 'Chunk has {} channels, expected {}'.format(
+                chunk.shape[0], number_of_channels)
+            np.ravel(chunk, order='F').astype(dtype).tofile(f)
+            written += chunk.shape[1]
+
+    assert written == number_of_readings, 'Wrote {} readings, expected {}'.format(written, number_of_readings)
+
+
+# _____PRIVATE FUNCTIONS____
+
+def _scan_directory(directory, extension, keyword=None):
+    # yield the directory entries of all files with a given extension and, if applicable, keyword
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(extension) and (keyword is None or keyword in entry.name) and entry.is_file():
+                yield entry
+
+
+def _try_build_session_manifest(directory, extension, keyword):
+    # build the manifest of a directory, or None if the directory itself cannot be scanned
+
+    try:
+        return build_session_manifest(directory, extension, keyword)
+    except OSError as e:
+        warnings.warn('Could not scan {}: {}'.format(directory, e))
+        return None
+
+
+def _parse_file_name(file_name):
+    # get the channel name and continuation index of a file -- files that are not a continuation have an index of 0
+
+    file_name_without_extension = os.path.splitext(file_name)[0]
+    match = CONTINUATION_PATTERN.match(file_name_without_extension)
+
+    if match is None:
+        return file_name_without_extension, 0
+
+    return match.group('name'), int(match.group('index'))